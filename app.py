@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import base64, io
+import base64, io, hashlib
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from PIL import Image
 import plotly.graph_objs as go
-from dash import Dash, dcc, html, Input, Output, State, dash_table
+from dash import Dash, dcc, html, Input, Output, State, dash_table, ClientsideFunction, Patch
+from flask_caching import Cache
 import dash
 
 # ------------------ 调色板 ------------------
@@ -23,10 +28,37 @@ PALETTES = {
     ]
 }
 
+# 预先转成 numpy 数组，按组下标直接取色
+PALETTE_NP = {name: np.asarray(colors, dtype=object) for name, colors in PALETTES.items()}
+
 UNASSIGNED_COLOR = "#A0A0A0"
 
 DEFAULT_GROUPS = 10
 
+MAX_IMAGE_SIDE = 2048
+
+# 点数超过该值且颜色种类不多时，改用颜色下标 + 离散 colorscale
+INDEXED_COLOR_MIN_POINTS = 200_000
+INDEXED_COLOR_MAX_COLORS = 16
+
+# assign-store 按列存储（struct-of-arrays），各列按下标对齐；cell_ids 为 Cell_ID 的 Categorical code，
+# "key" 记录这些 code 所属的 CSV（df 缓存 key）
+ASSIGN_COLUMNS = ["cell_ids", "groups", "group_idx", "customs", "colors"]
+
+def empty_assign(key=None):
+    assign = {k: [] for k in ASSIGN_COLUMNS}
+    assign["key"] = key
+    return assign
+
+def remap_assign(assign, old_cats, new_cats, key):
+    # 把旧 CSV 的 code 换算成新 CSV 的 code，新数据里没有的 Cell 丢弃
+    codes = pd.Index(new_cats).get_indexer(pd.Index(old_cats)[assign["cell_ids"]])
+    keep = codes >= 0
+    new_assign = {k: np.asarray(assign[k], dtype=object)[keep].tolist() for k in ASSIGN_COLUMNS}
+    new_assign["cell_ids"] = codes[keep].tolist()
+    new_assign["key"] = key
+    return new_assign
+
 def make_groups(palette="Tableau10"):
     return [
         {"Group Name": f"Group {i+1}", "Custom Name": "", "Color": PALETTES[palette][i]}
@@ -36,18 +68,20 @@ def make_groups(palette="Tableau10"):
 # ------------------ CSV 解析 ------------------
 def parse_csv(contents, has_header=True):
     content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
-    if has_header:
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-    else:
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')), header=None, names=["Cell_ID","X","Y"])
+    # 直接用 pyarrow 的多线程 C++ 读取器解析解码后的字节，不再转成 str
+    buf = pa.py_buffer(base64.b64decode(content_string))
+    read_options = pacsv.ReadOptions(column_names=None if has_header else ["Cell_ID","X","Y"])
+    df = pacsv.read_csv(pa.BufferReader(buf), read_options=read_options).to_pandas()
     cols = {c.lower(): c for c in df.columns}
     need = ["cell_id","x","y"]
     if not all(k in cols for k in need):
         raise ValueError("CSV must contain Cell_ID, X, Y")
     df = df[[cols["cell_id"], cols["x"], cols["y"]]].copy()
     df.columns = ["Cell_ID","X","Y"]
-    df["Cell_ID"] = df["Cell_ID"].astype(str)
+    # 坐标用 float32；Cell_ID 转成 Categorical，后续按整数 code 查找
+    df["X"] = df["X"].astype("float32")
+    df["Y"] = df["Y"].astype("float32")
+    df["Cell_ID"] = pd.Categorical(df["Cell_ID"].astype(str))
     return df
 
 # ------------------ 图片解析 ------------------
@@ -58,92 +92,124 @@ def decode_image(contents):
     decoded = base64.b64decode(content_string)
     im = Image.open(io.BytesIO(decoded)).convert("RGBA")
     w, h = im.size
-    return contents, w, h
+    # 缩到长边不超过 MAX_IMAGE_SIDE 并转成 WebP，减小 Store 和浏览器解码开销；返回原始宽高
+    s = MAX_IMAGE_SIDE / max(w, h)
+    if s < 1:
+        im = im.resize((max(1, int(w*s)), max(1, int(h*s))), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, "WEBP", quality=85)
+    return "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode(), w, h
 
 # ------------------ 绘图 ------------------
-def build_figure(df, assign_map, point_size,
-                 bg_image=None, img_meta=None, img_x_pct=50, img_y_pct=50, img_scale=0.5, img_opacity=0.6):
+def point_style(df, assign):
+    # 按 Cell_ID 对齐分组信息（向量化，无逐行循环）
+    n = len(df)
+    colors = np.full(n, UNASSIGNED_COLOR, dtype=object)
+    labels = np.full(n, "", dtype=object)
+    if assign and assign["cell_ids"]:
+        # code 是 0..K-1 的稠密整数，用查找表代替哈希连接
+        lut = np.full(len(df["Cell_ID"].cat.categories), -1, dtype=np.int64)
+        lut[np.asarray(assign["cell_ids"], dtype=np.int64)] = np.arange(len(assign["cell_ids"]))
+        idx = lut[df["Cell_ID"].cat.codes.to_numpy()]
+        hit = idx >= 0
+        colors[hit] = np.asarray(assign["colors"], dtype=object)[idx[hit]]
+        labels[hit] = (np.asarray(assign["groups"], dtype=object)[idx[hit]] + "<br>Custom: "
+                       + np.asarray(assign["customs"], dtype=object)[idx[hit]])
+    # 只返回分组部分，"Cell: ... Group:" 由 hovertemplate 在浏览器端拼
+    return colors, labels
+
+def marker_colors(colors):
+    if len(colors) <= INDEXED_COLOR_MIN_POINTS:
+        return {"color": colors}
+    codes, uniq = pd.factorize(colors)
+    k = len(uniq)
+    if k > INDEXED_COLOR_MAX_COLORS:
+        return {"color": colors}
+    scale = [[s, c] for i, c in enumerate(uniq) for s in (i/k, (i+1)/k)]
+    return {"color": codes.astype(np.int8), "colorscale": scale,
+            "cmin": -0.5, "cmax": k-0.5, "showscale": False}
+
+def axis_ranges(df):
+    # 数据范围外扩 5%；没有数据时用 0-100
     if df is None or df.empty:
-        fig = go.Figure()
-        fig.update_layout(
-            xaxis=dict(range=[0,100]), yaxis=dict(range=[0,100], scaleanchor="x"),
-            template="plotly_white", dragmode="lasso"
-        )
-        xr = [0, 100]
-        yr = [0, 100]
-        dx, dy = xr[1]-xr[0], yr[1]-yr[0]
-        xr = [xr[0]-0.05*dx, xr[1]+0.05*dx]
-        yr = [yr[0]-0.05*dy, yr[1]+0.05*dy]
-        fig.update_layout(
-            xaxis=dict(range=xr), yaxis=dict(range=yr, scaleanchor="x"),
-            template="plotly_white", dragmode="lasso"
-        )
-
-        # 加背景图
-        if bg_image and img_meta:
-            _, nat_w, nat_h = img_meta
-            sizex = (xr[1]-xr[0]) * img_scale
-            sizey = sizex * (nat_h/nat_w)
-            xpos = xr[0] + (xr[1]-xr[0]) * img_x_pct/100
-            ypos = yr[0] + (yr[1]-yr[0]) * img_y_pct/100
-            fig.add_layout_image(
-                dict(source=bg_image, xref="x", yref="y",
-                     x=xpos, y=ypos,
-                     sizex=sizex, sizey=sizey,
-                     xanchor="center", yanchor="middle",
-                     sizing="contain", opacity=img_opacity, layer="below")
-            )
-        return fig
-
-    colors, hovertext = [], []
-    for cid in df["Cell_ID"]:
-        if assign_map and cid in assign_map:
-            c = assign_map[cid]["Color"]
-            g = assign_map[cid]["Group"]
-            u = assign_map[cid].get("Custom","")
-            colors.append(c)
-            hovertext.append(f"Cell: {cid}<br>Group: {g}<br>Custom: {u}")
-        else:
-            colors.append("#A0A0A0")
-            hovertext.append(f"Cell: {cid}<br>Group: ")
-
-    fig = go.Figure(data=[go.Scattergl(
-        x=df["X"], y=df["Y"], mode="markers",
-        marker=dict(size=point_size, color=colors),
-        customdata=df["Cell_ID"], text=hovertext,
-        hovertemplate="%{text}<extra></extra>"
-    )])
-    xr = [df["X"].min(), df["X"].max()]
-    yr = [df["Y"].min(), df["Y"].max()]
+        xr, yr = [0, 100], [0, 100]
+    else:
+        xr = [df["X"].min(), df["X"].max()]
+        yr = [df["Y"].min(), df["Y"].max()]
     dx, dy = xr[1]-xr[0], yr[1]-yr[0]
     xr = [xr[0]-0.05*dx, xr[1]+0.05*dx]
     yr = [yr[0]-0.05*dy, yr[1]+0.05*dy]
-    fig.update_layout(
-        xaxis=dict(range=xr), yaxis=dict(range=yr, scaleanchor="x"),
-        template="plotly_white", dragmode="lasso"
-    )
-
+    return xr, yr
+
+def image_layout(bg_image, img_meta, xr, yr, img_x_pct, img_y_pct, img_scale, img_opacity):
+    nat_w, nat_h = img_meta
+    sizex = (xr[1]-xr[0]) * img_scale
+    sizey = sizex * (nat_h/nat_w)
+    xpos = xr[0] + (xr[1]-xr[0]) * img_x_pct/100
+    ypos = yr[0] + (yr[1]-yr[0]) * img_y_pct/100
+    return dict(source=bg_image, xref="x", yref="y",
+                x=xpos, y=ypos,
+                sizex=sizex, sizey=sizey,
+                xanchor="center", yanchor="middle",
+                sizing="contain", opacity=img_opacity, layer="below")
+
+def build_figure(df, assign, point_size,
+                 bg_image=None, img_meta=None, img_x_pct=50, img_y_pct=50, img_scale=0.5, img_opacity=0.6,
+                 uirevision="spots"):
+    # layout 一次构造好；uirevision 不变时保留用户的缩放/平移
+    xr, yr = axis_ranges(df)
     # 加背景图
+    images = []
     if bg_image and img_meta:
-        _, nat_w, nat_h = img_meta
-        sizex = (xr[1]-xr[0]) * img_scale
-        sizey = sizex * (nat_h/nat_w)
-        xpos = xr[0] + (xr[1]-xr[0]) * img_x_pct/100
-        ypos = yr[0] + (yr[1]-yr[0]) * img_y_pct/100
-        fig.add_layout_image(
-            dict(source=bg_image, xref="x", yref="y",
-                 x=xpos, y=ypos,
-                 sizex=sizex, sizey=sizey,
-                 xanchor="center", yanchor="middle",
-                 sizing="contain", opacity=img_opacity, layer="below")
-        )
-
-    return fig
+        images.append(image_layout(bg_image, img_meta, xr, yr, img_x_pct, img_y_pct, img_scale, img_opacity))
+    layout = go.Layout(
+        xaxis=dict(range=xr), yaxis=dict(range=yr, scaleanchor="x"),
+        template="plotly_white", dragmode="lasso",
+        uirevision=uirevision, transition_duration=0, images=images
+    )
+    if df is None or df.empty:
+        # 保留一个空 trace，data[0] 始终存在，Patch 可以直接写
+        return go.Figure(data=[go.Scattergl(x=[], y=[], mode="markers", marker=dict(size=point_size))],
+                         layout=layout)
+
+    colors, labels = point_style(df, assign)
+    # customdata 只放 Cell_ID 供悬停显示；选择时按 pointIndex 在服务端查 code。
+    # 注意 selectedData 会带上每个选中点的 customdata 和 text
+    return go.Figure(data=[go.Scattergl(
+        x=df["X"], y=df["Y"], mode="markers",
+        marker=dict(size=point_size, **marker_colors(colors)),
+        customdata=df["Cell_ID"].astype(str).to_numpy(dtype=object), text=labels,
+        hovertemplate="Cell: %{customdata}<br>Group: %{text}<extra></extra>"
+    )], layout=layout)
 
 # ------------------ App 初始化 ------------------
 app = Dash(__name__)
 app.title = "Spatial Spots Painter"
 
+# ------------------ 缓存 ------------------
+# SimpleCache 只在单个进程内有效，多 worker 部署时各进程互相看不到；
+# 每份 CSV 的 DataFrame 都在内存里，所以限制条目数并设置过期时间
+cache = Cache(app.server, config={
+    "CACHE_TYPE": "SimpleCache",
+    "CACHE_THRESHOLD": 8,
+    "CACHE_DEFAULT_TIMEOUT": 4 * 3600,
+})
+
+DATA_EXPIRED_MSG = "Data expired on the server, please re-upload the CSV"
+
+@cache.memoize()
+def decode_image_cached(contents):
+    return decode_image(contents)
+
+def df_to_store(df, key):
+    # DataFrame 只放在服务端缓存，Store 里只带 key，回调读 State 时不再上传整份数据
+    cache.set(key, df)
+    return {"key": key}
+
+def df_from_store(dfrec):
+    # 缓存丢失（过期或服务重启）时返回 None，调用方提示重新上传 CSV
+    return cache.get(dfrec["key"])
+
 def palette_options():
     opts = []
     for name, colors in PALETTES.items():
@@ -213,6 +279,8 @@ app.layout = html.Div([
     ], style={"display":"flex"}),
 
     dcc.Store(id="df-store"),
+    # 数据外扩后的坐标范围，背景图位置都按它计算（不随用户缩放变化）
+    dcc.Store(id="range-store", data=axis_ranges(None)),
     dcc.Store(id="assign-store"),
     dcc.Store(id="img-store"),
     dcc.Store(id="img-meta-store")
@@ -221,17 +289,37 @@ app.layout = html.Div([
 # ------------------ Callbacks ------------------
 @app.callback(
     Output("df-store","data"),
+    Output("range-store","data"),
+    Output("assign-store","data", allow_duplicate=True),
     Output("status-msg","children"),
     Input("upload-csv","contents"),
-    State("csv-has-header","value")
+    State("csv-has-header","value"),
+    State("assign-store","data"),
+    prevent_initial_call=True
 )
-def handle_csv(contents, header_val):
-    if not contents: return None, ""
+def handle_csv(contents, header_val, assign):
+    if not contents: return None, axis_ranges(None), dash.no_update, ""
+    has_header = "hdr" in (header_val or [])
     try:
-        df = parse_csv(contents, "hdr" in (header_val or []))
+        df = parse_csv(contents, has_header)
     except Exception as e:
-        return None, f"CSV error: {e}"
-    return df.to_dict("records"), ""
+        # 上传失败时保留已有分组
+        return None, axis_ranges(None), dash.no_update, f"CSV error: {e}"
+    key = "df:%s:%d" % (hashlib.sha1(contents.encode()).hexdigest(), has_header)
+    xr, yr = axis_ranges(df)
+    ranges = [[float(v) for v in xr], [float(v) for v in yr]]
+
+    # code 只在同一份 CSV 内有意义，换数据时按 Cell_ID 把已有分组映射过来
+    msg = ""
+    if not assign or assign.get("key") == key:
+        new_assign = dash.no_update
+    else:
+        old_df = cache.get(assign["key"]) if assign.get("key") else None
+        if old_df is None:
+            new_assign, msg = None, "Previous assignments expired on the server and were cleared"
+        else:
+            new_assign = remap_assign(assign, old_df["Cell_ID"].cat.categories, df["Cell_ID"].cat.categories, key)
+    return df_to_store(df, key), ranges, new_assign, msg
 
 @app.callback(
     Output("groups-table","data", allow_duplicate=True),
@@ -241,20 +329,17 @@ def handle_csv(contents, header_val):
     State("assign-store","data"),
     prevent_initial_call=True
 )
-def update_palette(palette, rows, assign_map):
+def update_palette(palette, rows, assign):
     colors = PALETTES[palette]
-    new_rows = []
     for i,row in enumerate(rows):
-        new_rows.append({"Group Name": row["Group Name"], "Custom Name": row.get("Custom Name",""), "Color": colors[i]})
-    # 更新 assign_map
-    if assign_map:
-        new_map = {}
-        for cid, info in assign_map.items():
-            idx = int(info["Group"].split()[-1]) - 1
-            new_color = colors[idx % len(colors)]
-            new_map[cid] = {"Group": info["Group"], "Custom": info.get("Custom",""), "Color": new_color}
-        assign_map = new_map
-    return new_rows, assign_map
+        row["Color"] = colors[i]
+    # 没有分组时不回写 assign-store，免得触发重新着色
+    if not assign:
+        return rows, dash.no_update
+    # 更新 assign 的颜色列（按存好的组下标取色，不再解析组名）
+    new_colors = PALETTE_NP[palette]
+    assign["colors"] = new_colors[np.asarray(assign["group_idx"], dtype=int) % len(new_colors)].tolist()
+    return rows, assign
 
 @app.callback(
     Output("img-store","data"),
@@ -263,98 +348,191 @@ def update_palette(palette, rows, assign_map):
 )
 def handle_image(contents):
     if not contents: return None, None
-    return decode_image(contents)[0], decode_image(contents)
+    data, w, h = decode_image_cached(contents)
+    # meta 只存宽高，不再重复携带整张图片
+    return data, (w, h)
 
 @app.callback(
     Output("spots-graph","figure"),
+    Output("status-msg","children", allow_duplicate=True),
     Input("df-store","data"),
+    State("point-size","value"),
+    State("assign-store","data"),
+    State("img-store","data"),
+    State("img-meta-store","data"),
+    State("img-x","value"),
+    State("img-y","value"),
+    State("img-scale","value"),
+    State("img-opacity","value"),
+    prevent_initial_call="initial_duplicate"
+)
+def update_plot(dfrec, point_size, assign, bg_img, img_meta, img_x, img_y, img_scale, img_opacity):
+    df = None if dfrec is None else df_from_store(dfrec)
+    if df is None:
+        msg = DATA_EXPIRED_MSG if dfrec is not None else dash.no_update
+        return build_figure(None, None, point_size, bg_img, img_meta, img_x, img_y, img_scale, img_opacity), msg
+    return build_figure(df, assign, point_size, bg_img, img_meta, img_x, img_y, img_scale, img_opacity,
+                        uirevision=dfrec["key"]), dash.no_update
+
+# 分组变化只重发颜色和分组标签，不重建整个图
+@app.callback(
+    Output("spots-graph","figure", allow_duplicate=True),
     Input("assign-store","data"),
-    Input("point-size","value"),
+    State("df-store","data"),
+    prevent_initial_call=True
+)
+def patch_assign(assign, dfrec):
+    # 分组被清空时 update_plot 已经画出全部未分配的点，不必再重发一遍
+    if not assign or not assign["cell_ids"]: return dash.no_update
+    # df-store 只带 key，这里只上传 key，从服务端缓存取 DataFrame
+    df = None if dfrec is None else df_from_store(dfrec)
+    if df is None: return dash.no_update
+    colors, labels = point_style(df, assign)
+    patched = Patch()
+    for k, v in marker_colors(colors).items():
+        patched["data"][0]["marker"][k] = v
+    patched["data"][0]["text"] = labels
+    return patched
+
+# 换背景图只改 layout.images，不重建散点
+@app.callback(
+    Output("spots-graph","figure", allow_duplicate=True),
     Input("img-store","data"),
     Input("img-meta-store","data"),
+    State("range-store","data"),
+    State("img-x","value"),
+    State("img-y","value"),
+    State("img-scale","value"),
+    State("img-opacity","value"),
+    prevent_initial_call=True
+)
+def patch_image(bg_img, img_meta, ranges, img_x, img_y, img_scale, img_opacity):
+    patched = Patch()
+    if not (bg_img and img_meta):
+        patched["layout"]["images"] = []
+        return patched
+    xr, yr = ranges or axis_ranges(None)
+    patched["layout"]["images"] = [image_layout(bg_img, img_meta, xr, yr, img_x, img_y, img_scale, img_opacity)]
+    return patched
+
+# 点大小只改 marker.size
+@app.callback(
+    Output("spots-graph","figure", allow_duplicate=True),
+    Input("point-size","value"),
+    prevent_initial_call=True
+)
+def patch_size(point_size):
+    patched = Patch()
+    patched["data"][0]["marker"]["size"] = point_size
+    return patched
+
+# 背景图滑块只改 layout.images，在浏览器端完成（assets/img.js）
+app.clientside_callback(
+    ClientsideFunction(namespace="img", function_name="updateOverlay"),
+    Output("spots-graph","figure", allow_duplicate=True),
     Input("img-x","value"),
     Input("img-y","value"),
     Input("img-scale","value"),
-    Input("img-opacity","value")
+    Input("img-opacity","value"),
+    State("spots-graph","figure"),
+    State("range-store","data"),
+    State("img-store","data"),
+    State("img-meta-store","data"),
+    prevent_initial_call=True
 )
-def update_plot(dfrec, assign_map, point_size, bg_img, img_meta, img_x, img_y, img_scale, img_opacity):
-    if dfrec is None:
-        return build_figure(None, {}, point_size, bg_img, img_meta, img_x, img_y, img_scale, img_opacity)
-    return build_figure(pd.DataFrame(dfrec), assign_map or {}, point_size, bg_img, img_meta, img_x, img_y, img_scale, img_opacity)
 
 @app.callback(
     Output("assign-store","data", allow_duplicate=True),
+    Output("status-msg","children", allow_duplicate=True),
     Input("spots-graph","selectedData"),
     State("groups-table","selected_rows"),
     State("groups-table","data"),
     State("assign-store","data"),
+    State("df-store","data"),
     prevent_initial_call=True
 )
-def assign_groups(selected, sel_rows, rows, assign_map):
-    if not selected or not sel_rows: return assign_map
+def assign_groups(selected, sel_rows, rows, assign, dfrec):
+    # 空套索（points 为空）也不回写，免得触发 patch_assign 重发全部颜色
+    if not selected or not selected.get("points") or not sel_rows or dfrec is None:
+        return dash.no_update, dash.no_update
+    df = df_from_store(dfrec)
+    if df is None: return dash.no_update, DATA_EXPIRED_MSG
     idx = sel_rows[0]
     group = rows[idx]["Group Name"]
-    custom = rows[idx]["Custom Name"]
+    custom = rows[idx]["Custom Name"] or ""
     color = rows[idx]["Color"]
-    assign_map = assign_map or {}
-    for pt in selected["points"]:
-        cid = pt["customdata"]
-        assign_map[str(cid)] = {"Group": group, "Custom": custom, "Color": color}
-    return assign_map
+    assign = assign or empty_assign(dfrec["key"])
+    point_idx = [pt["pointIndex"] for pt in selected["points"]]
+    new_ids = df["Cell_ID"].cat.codes.to_numpy()[point_idx].astype(int).tolist()
+    n = len(new_ids)
+    cols = {
+        "cell_ids": assign["cell_ids"] + new_ids,
+        "groups": assign["groups"] + [group] * n,
+        "group_idx": assign["group_idx"] + [idx] * n,
+        "customs": assign["customs"] + [custom] * n,
+        "colors": assign["colors"] + [color] * n,
+    }
+    # 同一个 Cell 重复分配时保留最后一次
+    keep = ~pd.Index(cols["cell_ids"]).duplicated(keep="last")
+    new_assign = {k: np.asarray(v, dtype=object)[keep].tolist() for k, v in cols.items()}
+    new_assign["key"] = dfrec["key"]
+    return new_assign, dash.no_update
 
 @app.callback(
     Output("download-csv","data"),
+    Output("status-msg","children", allow_duplicate=True),
     Input("export-btn","n_clicks"),
     State("assign-store","data"),
     State("df-store","data"),
     State("groups-table","data"),
     prevent_initial_call=True
 )
-def export_csv(_, assign_map, dfrec, groups_data):
+def export_csv(_, assign, dfrec, groups_data):
     if not dfrec:
-        return None
-
-    df = pd.DataFrame(dfrec)
-    groups, colors, custom_names = [], [], []
-
-    # 建立 Group -> Custom Name 的映射
-    group_to_custom = {row["Group Name"]: row.get("Custom Name", "") for row in groups_data}
-
-    for cid in df["Cell_ID"]:
-        cid = str(cid)
-        if assign_map and cid in assign_map:
-            g = assign_map[cid]["Group"]          # 原始组名 (Group 1, Group 2...)
-            c = assign_map[cid]["Color"]
-            groups.append(g)
-            colors.append(c)
-            # 映射 Custom Name，没有就空字符串
-            custom_names.append(group_to_custom.get(g, ""))
-        else:
-            groups.append("")
-            colors.append(UNASSIGNED_COLOR)
-            custom_names.append("")
-
-    out = pd.DataFrame({
-        "Cell_ID": df["Cell_ID"],
-        "Group": groups,
-        "Custom Name": custom_names,   # 👈 新列
-        "Color": colors
-    })
-    return dcc.send_data_frame(out.to_csv, "spots_assignments.csv", index=False)
+        return None, dash.no_update
+
+    df = df_from_store(dfrec)
+    if df is None:
+        return None, DATA_EXPIRED_MSG
+    assign = assign or empty_assign()
+    adf = pd.DataFrame({
+        "code": assign["cell_ids"],
+        "Group": assign["groups"],
+        "Color": assign["colors"],
+    }).astype({"code": "int64", "Group": object, "Color": object})
+
+    # 建立 Group -> Custom Name 的映射（组名重复时取最后一个，与原 dict 行为一致）
+    gdf = pd.DataFrame({
+        "Group": [row["Group Name"] for row in groups_data],
+        "Custom Name": [row.get("Custom Name", "") for row in groups_data],
+    }).dropna(subset=["Group"]).drop_duplicates("Group", keep="last")
+
+    out = (pd.DataFrame({"Cell_ID": df["Cell_ID"], "code": df["Cell_ID"].cat.codes.astype("int64")})
+           .merge(adf, on="code", how="left")
+           .merge(gdf, on="Group", how="left")
+           .fillna({"Group": "", "Custom Name": "", "Color": UNASSIGNED_COLOR}))
+    out = out[["Cell_ID", "Group", "Custom Name", "Color"]].astype({"Cell_ID": str})
+
+    # 用 pyarrow 的 C++ 写出器代替 pandas.to_csv（字符串字段会统一加引号）
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(out, preserve_index=False), buf,
+                    write_options=pacsv.WriteOptions(include_header=True))
+    return dcc.send_bytes(buf.getvalue(), "spots_assignments.csv"), dash.no_update
+
+# 表格每次编辑都会触发，颜色没变时直接复用
+@lru_cache(maxsize=32)
+def color_styles(colors):
+    return [
+        {"if": {"row_index": i, "column_id": "Color"}, "backgroundColor": c, "color": c}
+        for i, c in enumerate(colors)
+    ]
 
 @app.callback(
     Output("groups-table","style_data_conditional"),
     Input("groups-table","data")
 )
 def update_color_preview(rows):
-    conds = []
-    for i, r in enumerate(rows):
-        conds.append({
-            "if": {"row_index": i, "column_id": "Color"},
-            "backgroundColor": r["Color"],
-            "color": r["Color"]
-        })
-    return conds
+    return color_styles(tuple(r["Color"] for r in rows))
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,27 @@
+// 背景图叠加：滑块变化时只在浏览器端更新 layout.images，不回传服务端
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    img: {
+        updateOverlay: function(imgX, imgY, imgScale, imgOpacity, figure, ranges, bgImage, imgMeta) {
+            if (!figure || !ranges || !bgImage || !imgMeta) {
+                return window.dash_clientside.no_update;
+            }
+            // 用数据范围而不是 figure.layout 的轴范围：后者会随用户缩放变化
+            const xr = ranges[0];
+            const yr = ranges[1];
+            const natW = imgMeta[0], natH = imgMeta[1];
+            const sizex = (xr[1] - xr[0]) * imgScale;
+            const sizey = sizex * (natH / natW);
+            const xpos = xr[0] + (xr[1] - xr[0]) * imgX / 100;
+            const ypos = yr[0] + (yr[1] - yr[0]) * imgY / 100;
+            const image = {
+                source: bgImage, xref: "x", yref: "y",
+                x: xpos, y: ypos,
+                sizex: sizex, sizey: sizey,
+                xanchor: "center", yanchor: "middle",
+                sizing: "contain", opacity: imgOpacity, layer: "below"
+            };
+            const layout = Object.assign({}, figure.layout, {images: [image]});
+            return Object.assign({}, figure, {layout: layout});
+        }
+    }
+});